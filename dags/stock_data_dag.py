@@ -6,13 +6,78 @@ Airflow DAG for fetching and storing stock market data
 
 from datetime import datetime, timedelta
 from airflow import DAG
-from airflow.operators.bash import BashOperator
 from airflow.operators.python import PythonOperator
 from airflow.operators.empty import EmptyOperator
 import logging
+import os
+import threading
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    import json
+    json_loads = json.loads
 
 logger = logging.getLogger(__name__)
 
+SYMBOLS = ['AAPL', 'GOOGL', 'MSFT']
+SCRIPTS_DIR = '/opt/airflow/scripts'
+
+# Single-slot Airflow pool that serializes every task calling Alpha Vantage
+API_POOL = 'api_alpha_vantage'
+
+API_URL = 'https://www.alphavantage.co/query'
+API_KEY = os.getenv('ALPHA_VANTAGE_API_KEY')
+
+DB_CONFIG = {
+    'host': os.getenv('POSTGRES_HOST', 'postgres'),
+    'database': os.getenv('POSTGRES_DB', 'stock_data'),
+    'user': os.getenv('POSTGRES_USER', 'stockuser'),
+    'password': os.getenv('POSTGRES_PASSWORD', 'stockpass123'),
+    'port': os.getenv('POSTGRES_PORT', '5432')
+}
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def _mask_api_key(text):
+    """
+    Hide the API key in messages that embed the request URL
+    """
+    return text.replace(API_KEY, '***') if API_KEY else text
+
+
+def _get_session():
+    """
+    Return the shared requests session, creating it on first use
+    """
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            import requests
+            _SESSION = requests.Session()
+        return _SESSION
+
+
+_PG_POOL = None
+_PG_POOL_LOCK = threading.Lock()
+
+
+def _get_db_pool():
+    """
+    Return the shared PostgreSQL connection pool, creating it on first use
+    """
+    global _PG_POOL
+    with _PG_POOL_LOCK:
+        if _PG_POOL is None:
+            import atexit
+            from psycopg2.pool import ThreadedConnectionPool
+            _PG_POOL = ThreadedConnectionPool(1, 4, **DB_CONFIG)
+            atexit.register(_PG_POOL.closeall)
+        return _PG_POOL
+
 default_args = {
     'owner': 'stock-data-team',
     'depends_on_past': False,
@@ -37,54 +102,47 @@ def check_api_connection():
     """
     Check if we can connect to the Alpha Vantage API
     """
-    import os
-    import requests
-    
-    api_key = os.getenv('ALPHA_VANTAGE_API_KEY')
-    if not api_key:
+    if not API_KEY:
         raise ValueError("API key not found in environment variables!")
     
-    test_url = f"https://www.alphavantage.co/query?function=TIME_SERIES_INTRADAY&symbol=AAPL&interval=1min&apikey={api_key}"
+    params = {
+        'function': 'TIME_SERIES_INTRADAY',
+        'symbol': 'AAPL',
+        'interval': '1min',
+        'apikey': API_KEY
+    }
     
     try:
-        response = requests.get(test_url, timeout=30)
+        response = _get_session().get(API_URL, params=params, timeout=30)
         response.raise_for_status()
-        data = response.json()
+        data = json_loads(response.content)
         
         if 'Error Message' in data:
             raise Exception(f"API Error: {data['Error Message']}")
         
-        logger.info("API connection test successful!")
+        logger.info(f"API connection test successful! ({_mask_api_key(response.url)})")
         return True
         
     except Exception as e:
-        logger.error(f"API connection test failed: {e}")
-        raise
+        # requests errors carry the full URL including the key, so never re-raise them as-is
+        message = _mask_api_key(str(e))
+        logger.error(f"API connection test failed: {message}")
+        raise Exception(f"API connection test failed: {message}") from None
 
 def check_database_connection():
     """
     Check if we can connect to PostgreSQL database
     """
-    import os
-    import psycopg2
-    
-    db_config = {
-        'host': os.getenv('POSTGRES_HOST', 'postgres'),
-        'database': os.getenv('POSTGRES_DB', 'stock_data'),
-        'user': os.getenv('POSTGRES_USER', 'stockuser'),
-        'password': os.getenv('POSTGRES_PASSWORD', 'stockpass123'),
-        'port': os.getenv('POSTGRES_PORT', '5432')
-    }
-    
     try:
-        connection = psycopg2.connect(**db_config)
-        cursor = connection.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM stock_prices;")
-        count = cursor.fetchone()[0]
-        
-        cursor.close()
-        connection.close()
+        pool = _get_db_pool()
+        connection = pool.getconn()
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT COUNT(*) FROM stock_prices;")
+            count = cursor.fetchone()[0]
+            cursor.close()
+        finally:
+            pool.putconn(connection)
         
         logger.info(f"Database connection test successful! Found {count} records in stock_prices table.")
         return True
@@ -93,6 +151,47 @@ def check_database_connection():
         logger.error(f"Database connection test failed: {e}")
         raise
 
+def fetch_stock_symbols():
+    """
+    Fetch and store data for every symbol in a single task
+    """
+    import sys
+    
+    if SCRIPTS_DIR not in sys.path:
+        sys.path.insert(0, SCRIPTS_DIR)
+    from fetch_stock_data import StockDataFetcher
+    
+    fetcher = StockDataFetcher()
+    if not fetcher.run_pipeline(SYMBOLS):
+        raise Exception(f"Pipeline failed for one or more symbols: {SYMBOLS}")
+    
+    return True
+
+def verify_data_saved():
+    """
+    Summarize the stock data saved over the last 7 days
+    """
+    pool = _get_db_pool()
+    connection = pool.getconn()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT symbol, COUNT(*) as record_count, MAX(date) as latest_date "
+            "FROM stock_prices WHERE date >= CURRENT_DATE - INTERVAL '7 days' "
+            "GROUP BY symbol ORDER BY symbol;"
+        )
+        results = cursor.fetchall()
+        cursor.close()
+    finally:
+        pool.putconn(connection)
+    
+    logger.info("Recent stock data summary:")
+    for symbol, count, latest_date in results:
+        logger.info(f"  {symbol}: {count} records, latest: {latest_date}")
+    
+    logger.info("Data verification complete!")
+    return True
+
 start_task = EmptyOperator(
     task_id='start_pipeline',
     dag=dag,
@@ -101,6 +200,8 @@ start_task = EmptyOperator(
 check_api_task = PythonOperator(
     task_id='check_api_connection',
     python_callable=check_api_connection,
+    pool=API_POOL,
+    pool_slots=1,
     dag=dag,
 )
 
@@ -110,54 +211,18 @@ check_db_task = PythonOperator(
     dag=dag,
 )
 
-fetch_aapl_task = BashOperator(
-    task_id='fetch_aapl_data',
-    bash_command='cd /opt/airflow/scripts && python fetch_stock_data.py AAPL',
+fetch_symbols_task = PythonOperator(
+    task_id='fetch_symbols_data',
+    python_callable=fetch_stock_symbols,
+    pool=API_POOL,
+    pool_slots=1,
+    execution_timeout=timedelta(minutes=15),
     dag=dag,
 )
 
-fetch_googl_task = BashOperator(
-    task_id='fetch_googl_data',
-    bash_command='cd /opt/airflow/scripts && python fetch_stock_data.py GOOGL',
-    dag=dag,
-)
-
-fetch_msft_task = BashOperator(
-    task_id='fetch_msft_data',
-    bash_command='cd /opt/airflow/scripts && python fetch_stock_data.py MSFT',
-    dag=dag,
-)
-
-verify_data_task = BashOperator(
+verify_data_task = PythonOperator(
     task_id='verify_data_saved',
-    bash_command='''
-    cd /opt/airflow/scripts && python -c "
-import psycopg2
-import os
-
-db_config = {
-    'host': os.getenv('POSTGRES_HOST', 'postgres'),
-    'database': os.getenv('POSTGRES_DB', 'stock_data'),
-    'user': os.getenv('POSTGRES_USER', 'stockuser'),
-    'password': os.getenv('POSTGRES_PASSWORD', 'stockpass123'),
-    'port': os.getenv('POSTGRES_PORT', '5432')
-}
-
-connection = psycopg2.connect(**db_config)
-cursor = connection.cursor()
-
-cursor.execute('SELECT symbol, COUNT(*) as record_count, MAX(date) as latest_date FROM stock_prices WHERE date >= CURRENT_DATE - INTERVAL \\'7 days\\' GROUP BY symbol ORDER BY symbol;')
-
-results = cursor.fetchall()
-print('Recent stock data summary:')
-for symbol, count, latest_date in results:
-    print(f'  {symbol}: {count} records, latest: {latest_date}')
-
-cursor.close()
-connection.close()
-print('Data verification complete!')
-"
-    ''',
+    python_callable=verify_data_saved,
     dag=dag,
 )
 
@@ -170,16 +235,9 @@ end_task = EmptyOperator(
 start_task >> check_api_task
 start_task >> check_db_task
 
-check_api_task >> fetch_aapl_task
-check_api_task >> fetch_googl_task
-check_api_task >> fetch_msft_task
-
-check_db_task >> fetch_aapl_task
-check_db_task >> fetch_googl_task
-check_db_task >> fetch_msft_task
+check_api_task >> fetch_symbols_task
+check_db_task >> fetch_symbols_task
 
-fetch_aapl_task >> verify_data_task
-fetch_googl_task >> verify_data_task
-fetch_msft_task >> verify_data_task
+fetch_symbols_task >> verify_data_task
 
 verify_data_task >> end_task
\ No newline at end of file
@@ -6,14 +6,23 @@ Fetches stock data from Alpha Vantage API and stores it in PostgreSQL
 
 import os
 import sys
-import requests
-import psycopg2
-import pandas as pd
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+import atexit
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from operator import itemgetter
+from heapq import nlargest
+from typing import Dict, List, Optional, Tuple
+import threading
 import time
-import random
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    import json
+    json_loads = json.loads
 
 logging.basicConfig(
     level=logging.INFO,
@@ -21,6 +30,128 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+API_KEY = os.getenv('ALPHA_VANTAGE_API_KEY')
+
+DB_CONFIG = {
+    'host': os.getenv('POSTGRES_HOST', 'postgres'),
+    'database': os.getenv('POSTGRES_DB', 'stock_data'),
+    'user': os.getenv('POSTGRES_USER', 'stockuser'),
+    'password': os.getenv('POSTGRES_PASSWORD', 'stockpass123'),
+    'port': os.getenv('POSTGRES_PORT', '5432')
+}
+
+# Alpha Vantage free tier allows 5 requests per minute
+API_CALLS_PER_MINUTE = 5
+MAX_CONCURRENT_REQUESTS = 5
+# Minimum spacing between calls; simultaneous bursts trip the free-tier burst check
+MIN_CALL_INTERVAL = 1.0
+
+# Top-level keys Alpha Vantage uses to signal what kind of response it sent, in priority order
+RESPONSE_MARKERS = ('Error Message', 'Note', 'Information', 'Time Series (Daily)')
+
+# Pulls open/high/low/close/volume out of one daily API entry in a single call
+_get_ohlcv = itemgetter('1. open', '2. high', '3. low', '4. close', '5. volume')
+
+# Column order of the record tuples built by parse_stock_data and inserted into stock_prices
+STOCK_COLUMNS = ('symbol', 'date', 'open_price', 'high_price', 'low_price', 'close_price', 'volume')
+
+UPSERT_CONFLICT_CLAUSE = """
+    ON CONFLICT (symbol, date) 
+    DO UPDATE SET 
+        open_price = EXCLUDED.open_price,
+        high_price = EXCLUDED.high_price,
+        low_price = EXCLUDED.low_price,
+        close_price = EXCLUDED.close_price,
+        volume = EXCLUDED.volume,
+        created_at = CURRENT_TIMESTAMP
+"""
+
+_COLUMN_LIST = ', '.join(STOCK_COLUMNS)
+
+# The upsert statement is built once at import. execute_values sends one statement
+# per page, so Postgres parses and plans the upsert once per 1000 rows
+UPSERT_QUERY = f"""
+    INSERT INTO stock_prices ({_COLUMN_LIST})
+    VALUES %s
+    {UPSERT_CONFLICT_CLAUSE}
+"""
+
+UPSERT_TEMPLATE = f"({', '.join(['%s'] * len(STOCK_COLUMNS))})"
+
+
+def mask_api_key(text: str) -> str:
+    """
+    Hide the API key in messages that embed the request URL
+    """
+    return text.replace(API_KEY, '***') if API_KEY else text
+
+
+class ApiKeyFilter(logging.Filter):
+    """
+    Mask the API key in log records, e.g. urllib3's retry warnings that include the URL
+    """
+    
+    def filter(self, record):
+        record.msg = mask_api_key(record.getMessage())
+        record.args = ()
+        return True
+
+
+logging.getLogger('urllib3.connectionpool').addFilter(ApiKeyFilter())
+
+
+_PG_POOL = None
+_PG_POOL_LOCK = threading.Lock()
+
+
+def get_db_pool(db_config: Dict):
+    """
+    Return the shared PostgreSQL connection pool, creating it on first use
+    """
+    global _PG_POOL
+    with _PG_POOL_LOCK:
+        if _PG_POOL is None:
+            from psycopg2.pool import ThreadedConnectionPool
+            _PG_POOL = ThreadedConnectionPool(1, 8, **db_config)
+            atexit.register(_PG_POOL.closeall)
+        return _PG_POOL
+
+
+class RateLimiter:
+    """
+    Sliding-window rate limiter that blocks once the call budget is used up
+    and keeps a minimum gap between consecutive calls
+    """
+    
+    def __init__(self, max_calls: int, period: float, min_interval: float = 0.0):
+        self.max_calls = max_calls
+        self.period = period
+        self.min_interval = min_interval
+        self._calls = deque()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """
+        Wait until another call fits in the current window
+        """
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= self.period:
+                    self._calls.popleft()
+                
+                if self._calls and now - self._calls[-1] < self.min_interval:
+                    time.sleep(self.min_interval - (now - self._calls[-1]))
+                    continue
+                
+                if len(self._calls) < self.max_calls:
+                    self._calls.append(now)
+                    return
+                
+                wait = self.period - (now - self._calls[0])
+                logger.info(f"API rate limit reached, waiting {wait:.1f}s")
+                time.sleep(wait)
+
 
 class StockDataFetcher:
     """
@@ -28,63 +159,133 @@ class StockDataFetcher:
     """
     
     def __init__(self):
-        self.api_key = os.getenv('ALPHA_VANTAGE_API_KEY')
+        self.api_key = API_KEY
         if not self.api_key:
             raise ValueError("API key not found! Check your .env file")
         
-        self.db_config = {
-            'host': os.getenv('POSTGRES_HOST', 'postgres'),
-            'database': os.getenv('POSTGRES_DB', 'stock_data'),
-            'user': os.getenv('POSTGRES_USER', 'stockuser'),
-            'password': os.getenv('POSTGRES_PASSWORD', 'stockpass123'),
-            'port': os.getenv('POSTGRES_PORT', '5432')
-        }
+        self.db_config = DB_CONFIG
         
         self.base_url = "https://www.alphavantage.co/query"
+        
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        
+        # Keep-alive session so every symbol reuses the same TLS connection
+        self.session = requests.Session()
+        # Transient 5xx responses are retried inside urllib3 with exponential
+        # backoff, honouring any Retry-After header the API sends. These retries
+        # bypass the rate limiter, so keep them few; quota errors arrive as HTTP 200
+        # with a Note/Information body and are never retried here
+        retries = Retry(
+            total=2,
+            backoff_factor=0.8,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=frozenset({'GET'}),
+            respect_retry_after_header=True
+        )
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=MAX_CONCURRENT_REQUESTS,
+            max_retries=retries
+        )
+        self.session.mount('https://', adapter)
+        self.rate_limiter = RateLimiter(API_CALLS_PER_MINUTE, 60, MIN_CALL_INTERVAL)
+        
+        self.response_handlers = {
+            'Error Message': self._handle_api_error,
+            'Note': self._handle_api_note,
+            'Information': self._handle_api_information,
+            'Time Series (Daily)': self._handle_time_series
+        }
+        
         logger.info("Robot initialized successfully!")
     
-    def get_demo_data(self, symbol: str) -> Dict:
+    def get_demo_data(self, symbol: str, days: int = 7) -> Dict:
         """
         Generate demo stock data when API is not available
         """
+        import numpy as np
+        
         logger.info(f"Generating demo data for {symbol}")
         
         base_price = {'AAPL': 150.0, 'GOOGL': 2500.0, 'MSFT': 300.0}.get(symbol, 100.0)
-        time_series = {}
+        rng = np.random.default_rng()
         
-        for i in range(7):
-            date = (datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d')
-            
-            daily_change = random.uniform(-0.05, 0.05)
-            open_price = base_price * (1 + random.uniform(-0.02, 0.02))
-            close_price = open_price * (1 + daily_change)
-            high_price = max(open_price, close_price) * (1 + random.uniform(0, 0.03))
-            low_price = min(open_price, close_price) * (1 - random.uniform(0, 0.03))
-            volume = random.randint(1000000, 10000000)
-            
-            time_series[date] = {
-                '1. open': f"{open_price:.2f}",
-                '2. high': f"{high_price:.2f}",
-                '3. low': f"{low_price:.2f}",
-                '4. close': f"{close_price:.2f}",
-                '5. volume': str(volume)
+        daily_change = rng.uniform(-0.05, 0.05, days)
+        open_prices = base_price * (1 + rng.uniform(-0.02, 0.02, days))
+        close_prices = open_prices * (1 + daily_change)
+        high_prices = np.maximum(open_prices, close_prices) * (1 + rng.uniform(0, 0.03, days))
+        low_prices = np.minimum(open_prices, close_prices) * (1 - rng.uniform(0, 0.03, days))
+        volumes = rng.integers(1000000, 10000000, days, endpoint=True)
+        
+        now = datetime.now()
+        dates = [(now - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+        
+        time_series = {
+            day: {
+                '1. open': open_price,
+                '2. high': high_price,
+                '3. low': low_price,
+                '4. close': close_price,
+                '5. volume': volume
             }
+            for day, open_price, high_price, low_price, close_price, volume in zip(
+                dates,
+                np.char.mod('%.2f', open_prices).tolist(),
+                np.char.mod('%.2f', high_prices).tolist(),
+                np.char.mod('%.2f', low_prices).tolist(),
+                np.char.mod('%.2f', close_prices).tolist(),
+                volumes.astype(str).tolist()
+            )
+        }
         
         return {
             'Time Series (Daily)': time_series,
             'Meta Data': {
                 '1. Information': f"Demo Daily Prices and Volumes for {symbol}",
                 '2. Symbol': symbol,
-                '3. Last Refreshed': datetime.now().strftime('%Y-%m-%d'),
+                '3. Last Refreshed': now.strftime('%Y-%m-%d'),
                 '4. Output Size': 'Compact',
                 '5. Time Zone': 'US/Eastern'
             }
         }
     
+    def _handle_api_error(self, data: Dict, symbol: str) -> Optional[Dict]:
+        """
+        Log an API error response; there is no data to use
+        """
+        logger.error(f"API Error: {data['Error Message']}")
+        return None
+    
+    def _handle_api_note(self, data: Dict, symbol: str) -> Optional[Dict]:
+        """
+        Log an API limit note; there is no data to use
+        """
+        logger.warning(f"API Limit Warning: {data['Note']}")
+        return None
+    
+    def _handle_api_information(self, data: Dict, symbol: str) -> Optional[Dict]:
+        """
+        Fall back to demo data when the API reports a rate limit
+        """
+        logger.warning(f"API Rate Limit: {data['Information']}")
+        logger.info("Using demo data instead...")
+        return self.get_demo_data(symbol)
+    
+    def _handle_time_series(self, data: Dict, symbol: str) -> Optional[Dict]:
+        """
+        Return a successful time series response as-is
+        """
+        logger.info(f"Successfully fetched data for {symbol}")
+        return data
+    
     def fetch_stock_data(self, symbol: str = "AAPL") -> Optional[Dict]:
         """
         Fetch stock data from Alpha Vantage API
         """
+        import requests
+        
         logger.info(f"Calling API for symbol: {symbol}")
         
         params = {
@@ -95,45 +296,31 @@ class StockDataFetcher:
         }
         
         try:
-            response = requests.get(self.base_url, params=params, timeout=30)
+            self.rate_limiter.acquire()
+            response = self.session.get(self.base_url, params=params, timeout=30)
             response.raise_for_status()
             
-            data = response.json()
+            data = json_loads(response.content)
             
-            if 'Error Message' in data:
-                logger.error(f"API Error: {data['Error Message']}")
-                return None
-            
-            if 'Note' in data:
-                logger.warning(f"API Limit Warning: {data['Note']}")
-                return None
-                
-            if 'Information' in data:
-                logger.warning(f"API Rate Limit: {data['Information']}")
-                logger.info("Using demo data instead...")
-                return self.get_demo_data(symbol)
-            
-            if 'Time Series (Daily)' not in data:
+            marker = next((key for key in RESPONSE_MARKERS if key in data), None)
+            if marker is None:
                 logger.error(f"Unexpected API response format: {list(data.keys())}")
-                if 'Information' in data:
-                    logger.error(f"API Rate limit message: {data['Information']}")
                 logger.error(f"Full response: {data}")
                 logger.info("Using demo data instead...")
                 return self.get_demo_data(symbol)
             
-            logger.info(f"Successfully fetched data for {symbol}")
-            return data
+            return self.response_handlers[marker](data, symbol)
             
         except requests.exceptions.RequestException as e:
-            logger.error(f"Network error while fetching data: {e}")
+            logger.error(f"Network error while fetching data: {mask_api_key(str(e))}")
             logger.info("Using demo data instead...")
             return self.get_demo_data(symbol)
         except Exception as e:
-            logger.error(f"Unexpected error while fetching data: {e}")
+            logger.error(f"Unexpected error while fetching data: {mask_api_key(str(e))}")
             logger.info("Using demo data instead...")
             return self.get_demo_data(symbol)
     
-    def parse_stock_data(self, data: Dict, symbol: str) -> List[Dict]:
+    def parse_stock_data(self, data: Dict, symbol: str) -> List[Tuple]:
         """
         Parse the API response and convert it to database format
         """
@@ -143,20 +330,21 @@ class StockDataFetcher:
             time_series = data['Time Series (Daily)']
             parsed_data = []
             
-            sorted_dates = sorted(time_series.keys(), reverse=True)[:7]
+            # ISO dates sort lexically, so the 7 largest keys are the most recent days
+            sorted_dates = nlargest(7, time_series)
             
             for date_str in sorted_dates:
-                daily_data = time_series[date_str]
+                open_price, high_price, low_price, close_price, volume = _get_ohlcv(time_series[date_str])
                 
-                record = {
-                    'symbol': symbol,
-                    'date': datetime.strptime(date_str, '%Y-%m-%d').date(),
-                    'open_price': float(daily_data['1. open']),
-                    'high_price': float(daily_data['2. high']),
-                    'low_price': float(daily_data['3. low']),
-                    'close_price': float(daily_data['4. close']),
-                    'volume': int(daily_data['5. volume'])
-                }
+                record = (
+                    symbol,
+                    date.fromisoformat(date_str),
+                    float(open_price),
+                    float(high_price),
+                    float(low_price),
+                    float(close_price),
+                    int(volume)
+                )
                 
                 parsed_data.append(record)
             
@@ -169,20 +357,24 @@ class StockDataFetcher:
     
     def connect_to_database(self):
         """
-        Connect to PostgreSQL database
+        Get a PostgreSQL connection from the shared pool
         """
         try:
-            connection = psycopg2.connect(**self.db_config)
+            connection = get_db_pool(self.db_config).getconn()
+            # Each save runs as one transaction with a single commit at the end
+            connection.autocommit = False
             logger.info("Connected to database successfully")
             return connection
         except Exception as e:
             logger.error(f"Failed to connect to database: {e}")
             return None
     
-    def save_to_database(self, records: List[Dict]) -> bool:
+    def save_to_database(self, records: List[Tuple]) -> bool:
         """
         Save stock data to PostgreSQL database
         """
+        from psycopg2.extras import execute_values
+        
         if not records:
             logger.warning("No records to save")
             return False
@@ -194,20 +386,8 @@ class StockDataFetcher:
         try:
             cursor = connection.cursor()
             
-            insert_query = """
-                INSERT INTO stock_prices (symbol, date, open_price, high_price, low_price, close_price, volume)
-                VALUES (%(symbol)s, %(date)s, %(open_price)s, %(high_price)s, %(low_price)s, %(close_price)s, %(volume)s)
-                ON CONFLICT (symbol, date) 
-                DO UPDATE SET 
-                    open_price = EXCLUDED.open_price,
-                    high_price = EXCLUDED.high_price,
-                    low_price = EXCLUDED.low_price,
-                    close_price = EXCLUDED.close_price,
-                    volume = EXCLUDED.volume,
-                    created_at = CURRENT_TIMESTAMP
-            """
+            execute_values(cursor, UPSERT_QUERY, records, template=UPSERT_TEMPLATE, page_size=1000)
             
-            cursor.executemany(insert_query, records)
             connection.commit()
             
             logger.info(f"Successfully saved {len(records)} records to database")
@@ -220,8 +400,8 @@ class StockDataFetcher:
             
         finally:
             cursor.close()
-            connection.close()
-            logger.info("Database connection closed")
+            get_db_pool(self.db_config).putconn(connection)
+            logger.info("Database connection returned to pool")
     
     def run_pipeline(self, symbols: List[str] = None) -> bool:
         """
@@ -234,34 +414,40 @@ class StockDataFetcher:
         
         overall_success = True
         
-        for symbol in symbols:
-            try:
-                logger.info(f"Processing {symbol}...")
-                
-                raw_data = self.fetch_stock_data(symbol)
-                if not raw_data:
-                    logger.error(f"Failed to fetch data for {symbol}")
-                    overall_success = False
-                    continue
-                
-                parsed_records = self.parse_stock_data(raw_data, symbol)
-                if not parsed_records:
-                    logger.error(f"Failed to parse data for {symbol}")
-                    overall_success = False
-                    continue
-                
-                if not self.save_to_database(parsed_records):
-                    logger.error(f"Failed to save data for {symbol}")
+        try:
+            # Fetch every symbol concurrently; the rate limiter keeps us within the API quota
+            workers = max(1, min(MAX_CONCURRENT_REQUESTS, len(symbols)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                raw_results = list(executor.map(self.fetch_stock_data, symbols))
+            
+            for symbol, raw_data in zip(symbols, raw_results):
+                try:
+                    logger.info(f"Processing {symbol}...")
+                    
+                    if not raw_data:
+                        logger.error(f"Failed to fetch data for {symbol}")
+                        overall_success = False
+                        continue
+                    
+                    parsed_records = self.parse_stock_data(raw_data, symbol)
+                    if not parsed_records:
+                        logger.error(f"Failed to parse data for {symbol}")
+                        overall_success = False
+                        continue
+                    
+                    if not self.save_to_database(parsed_records):
+                        logger.error(f"Failed to save data for {symbol}")
+                        overall_success = False
+                        continue
+                    
+                    logger.info(f"Successfully processed {symbol}")
+                    
+                except Exception as e:
+                    logger.error(f"Unexpected error processing {symbol}: {e}")
                     overall_success = False
                     continue
-                
-                logger.info(f"Successfully processed {symbol}")
-                time.sleep(12)
-                
-            except Exception as e:
-                logger.error(f"Unexpected error processing {symbol}: {e}")
-                overall_success = False
-                continue
+        finally:
+            self.session.close()
         
         if overall_success:
             logger.info("Pipeline completed successfully for all symbols!")